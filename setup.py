@@ -12,7 +12,6 @@ setup(
     install_requires=[
         'python-daemon',
         'dpkt',
-        'pyip',
         'docopt',
     ],
 
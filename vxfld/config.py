@@ -125,6 +125,16 @@ class Config:
             return True
         return False
 
+    def float_checker(self, param, cb=None):
+        self._checkers[param] = (Config._float_checker, cb)
+
+    def _float_checker(self, val):
+        """ Returns float from string or number. """
+        try:
+            return float(val)
+        except:
+            raise RuntimeError('Invalid number %s' % val)
+
     def list_checker(self, param, cb=None):
         self._checkers[param] = (Config._list_checker, cb)
 
@@ -170,6 +180,8 @@ defaults = {
     'vxlan_port': '4789',  # port for vxlan tunnel pkts
     'vxfld_port': '10001',  # port for vxfld messages
     'holdtime': '90',  # how long to hold soft state
+    'vxfld_mtu': '1500',  # vxfld msgs are split to fit in this
+    'metrics_port': '0',  # port to serve Prometheus metrics on, 0 for none
 
     #  vxsnd specific.  Add these here to prime the config object with
     #  these attributes before config file is read.  Does no harm if
@@ -182,11 +194,26 @@ defaults = {
     'max_packet_size': '1500',
     'receive_queue': '131072',
     'enable_udp_chksum': 'true',
+    'batch_size': '0',  # pkts per recvmmsg, 0 to disable batched I/O
+    'workers': '0',  # flood worker processes, 0 to flood in main process
+    'shared_fdb_size': '16777216',  # bytes of shared mem for workers' fdb
+    'announce_delay': '0.2',  # secs to collect learned addrs for peers
+    'delta_replication': 'false',  # send peers changes, not refreshes
+    'snapshot_interval': '0',  # secs between fdb snapshots, 0 for none
+    'flood_src_rate': '0',  # most pkts/sec flooded per source, 0 no limit
+    'flood_vni_rate': '0',  # most pkts/sec flooded per VNI, 0 no limit
+    'tier_replicators': '',  # vxsnds to share flooding of big VNIs with
+    'tier_threshold': '128',  # VTEPs in a VNI for it to be flooded tiered
+    'tier_port': '10002',  # port for pkts from the first tier
+    'shard_replicas': '0',  # servers owning each VNI, 0 for all of them
+    'shard_port': '10003',  # port for pkts forwarded to a VNI's owner
 
     #  .. and vxrd specific.
     'local_addr': '',  # Used if none configured on vxlan if
     'svcnode': '',  # Used if none configured on vxlan if
     'refresh_rate': '3',  # how often to refresh within holdtime
+    'refresh_jitter': '0.1',  # fraction of refresh interval to jitter by
+    'refresh_msg_rate': '10',  # most refresh msgs per sec, 0 for no limit
     'config_check_rate': 10,    # secs between checking for config changes
     'selfrep': 'false',
 }
@@ -232,6 +259,8 @@ def init(args):
     config.int_checker('vxlan_port')
     config.int_checker('vxfld_port')
     config.int_checker('holdtime')
+    config.int_checker('vxfld_mtu')
+    config.int_checker('metrics_port')
 
     # vxsnd
     config.addr_checker('address')
@@ -241,11 +270,26 @@ def init(args):
     config.int_checker('max_packet_size')
     config.int_checker('receive_queue')
     config.bool_checker('enable_udp_chksum')
+    config.int_checker('batch_size')
+    config.int_checker('workers')
+    config.int_checker('shared_fdb_size')
+    config.float_checker('announce_delay')
+    config.bool_checker('delta_replication')
+    config.int_checker('snapshot_interval')
+    config.int_checker('flood_src_rate')
+    config.int_checker('flood_vni_rate')
+    config.checker(servers, 'tier_replicators')
+    config.int_checker('tier_threshold')
+    config.int_checker('tier_port')
+    config.int_checker('shard_replicas')
+    config.int_checker('shard_port')
 
     # vxrd
     config.addr_checker('local_addr')
     config.addr_checker('svcnode')
     config.int_checker('refresh_rate')
+    config.float_checker('refresh_jitter')
+    config.int_checker('refresh_msg_rate')
     config.int_checker('config_check_rate')
     config.bool_checker('selfrep')
 
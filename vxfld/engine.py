@@ -0,0 +1,156 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Prioritized event loop
+
+An Engine runs a daemon's work as separate tasks of two kinds:
+
+    readers     a handler for a file, called when the file is readable
+    jobs        generators for long work, each next() doing a slice
+
+A reader's handler reads and handles one unit of work, say a pkt or
+a batch of them, and returns False if there was nothing to read.  It is
+called up to budget times a turn while it keeps finding work, so no
+reader can keep the others waiting for long.  Readers are served in
+order of priority, FLOOD before CONTROL.
+
+Between each unit of work for a CONTROL reader and each slice of a
+job, the FLOOD readers are checked and served first if they have
+anything waiting.  So a burst of control msgs or a long job adds at
+most one unit of control work to the latency of a flooded pkt.
+
+The daemon's loop calls wait(), which doesn't wait at all if a job has
+work left, and then dispatch().  Anything else the loop does, such as
+taking a lock, goes between the two.
+"""
+
+import collections
+import errno
+import select
+
+# Reader priorities, most urgent first
+FLOOD = 0
+CONTROL = 1
+
+
+class _Reader(object):
+
+    __slots__ = ('fileobj', 'handler', 'priority', 'budget')
+
+    def __init__(self, fileobj, handler, priority, budget):
+        self.fileobj = fileobj
+        self.handler = handler
+        self.priority = priority
+        self.budget = budget
+
+
+class Engine(object):
+    """ Readers and jobs, run by priority and a bounded amount at a time. """
+
+    def __init__(self):
+        self.readers = []
+        self.flood = []     # just the FLOOD readers
+        self.jobs = collections.OrderedDict()   # name -> generator
+        self.ready = []
+
+    def add_reader(self, fileobj, handler, priority=CONTROL, budget=1):
+        """
+        Call handler() when fileobj is readable, up to budget times a
+        turn until it returns False.  fileobj is anything select takes.
+        """
+
+        reader = _Reader(fileobj, handler, priority, budget)
+        self.readers.append(reader)
+        self.readers.sort(key=lambda r: r.priority)
+        if priority == FLOOD:
+            self.flood.append(reader)
+
+    def spawn(self, name, job):
+        """
+        Run the generator job, a slice a turn, until it finishes.  Does
+        nothing if a job called name is still running.
+        """
+
+        if name not in self.jobs:
+            self.jobs[name] = job
+
+    def busy(self):
+        """ True if a job has work left. """
+        return bool(self.jobs)
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout secs for a reader's file to be readable.  If
+        a job has work left, just check.  Returns the readable files.
+        """
+
+        if self.jobs:
+            timeout = 0
+        try:
+            self.ready = select.select([r.fileobj for r in self.readers],
+                                       [], [], timeout)[0]
+        except select.error as e:
+            if e[0] != errno.EINTR:
+                raise
+            self.ready = []
+        return self.ready
+
+    def dispatch(self):
+        """
+        Serve the readers whose files wait() found readable, by
+        priority, then run a slice of each job.
+        """
+
+        ready = set(self.ready)
+        self.ready = []
+        for reader in self.readers:
+            if reader.fileobj in ready:
+                self._serve(reader)
+
+        for (name, job) in self.jobs.items():
+            try:
+                next(job)
+            except StopIteration:
+                del self.jobs[name]
+            self._preempt()
+
+    def _serve(self, reader):
+        for i in xrange(reader.budget):
+            if not reader.handler():
+                break
+            if reader.priority != FLOOD:
+                self._preempt()
+
+    def _preempt(self):
+        # Serve the flood readers if anything has come in for them
+        if not self.flood:
+            return
+        try:
+            ready = select.select([r.fileobj for r in self.flood], [], [],
+                                  0)[0]
+        except select.error as e:
+            if e[0] != errno.EINTR:
+                raise
+            return
+        for reader in self.flood:
+            if reader.fileobj in ready:
+                self._serve(reader)
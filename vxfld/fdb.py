@@ -0,0 +1,466 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Forwarding Database
+
+The fdb holds the set of VTEP addresses that are members of each VNI,
+each with the absolute time at which it ages out.
+
+VNIs and addresses are kept as 32 bit integers rather than strings.
+Each VNI's members are held in a pair of parallel arrays, sorted by
+address, so an entry costs 8 bytes instead of a string, an int and a
+dict slot.  Lookups are a binary search.  Addresses are converted to
+dotted decimal strings only for display.
+
+Ageout is driven by an expiry index rather than by scanning the fdb.
+timers[ageout] = set(key, ...) holds the entries that age out in that
+second, where key is (vni << 32 | addr), and each second with a set is
+in timer_heap so the earliest is always at hand.  Refreshing an entry
+moves it between two sets, and ageout only looks at the seconds that
+have passed, so the cost of either does not depend on the size of the
+fdb.
+
+snapshot() returns the whole fdb as a string that load() can read
+back, say after a restart.  It is just each VNI's arrays back to back
+so both are quick.  The loaded entries are not checked or put in the
+expiry index one by one, as that would take far longer than the load.
+Instead each loaded VNI is left unscanned with a single timer, key
+~vni, for its earliest ageout.  The VNI is scanned, dropping the
+entries that had aged out by the time of the load and indexing the
+rest, the first time it is used or when its timer fires, whichever is
+first.  Snapshots use native byte order and are only meant to be read
+back on the same machine.
+
+freeze() returns a FrozenFdb, an immutable copy of the fdb that other
+threads can read without any locking while the fdb carries on
+changing.  The fdb keeps the set of VNIs changed since the last
+freeze(), and the next one only copies those.  The rest are shared
+with the FrozenFdb before, so freezing often costs little more than
+the changes themselves.
+"""
+
+import array
+import bisect
+import heapq
+import socket
+import struct
+import sys
+
+_addr = struct.Struct('!I')
+
+SNAPSHOT_MAGIC = 0x76786664     # 'vxfd'
+_snap_hdr = struct.Struct('=II')    # magic, VNI count
+_snap_vni = struct.Struct('=II')    # vni, member count
+
+
+def aton(ip):
+    """ Dotted decimal string to integer address. """
+    return _addr.unpack(socket.inet_aton(ip))[0]
+
+
+def ntoa(addr):
+    """ Integer address to dotted decimal string. """
+    return socket.inet_ntoa(_addr.pack(addr))
+
+
+class VniMembers(object):
+    """ The members of one VNI, sorted by address. """
+
+    __slots__ = ('addrs', 'ageouts')
+
+    def __init__(self):
+        self.addrs = array.array('I')
+        self.ageouts = array.array('I')
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def find(self, addr):
+        """ Index of addr, or -1 if not a member. """
+        i = bisect.bisect_left(self.addrs, addr)
+        if i < len(self.addrs) and self.addrs[i] == addr:
+            return i
+        return -1
+
+
+class Fdb(object):
+    """ The forwarding DB.  Iterating over it gives the VNIs. """
+
+    __slots__ = ('vnis', 'timers', 'timer_heap', 'unscanned', 'load_time',
+                 'dirty', 'version')
+
+    def __init__(self):
+        self.vnis = {}
+        self.timers = {}
+        self.timer_heap = []
+        self.unscanned = set()
+        self.load_time = 0
+        self.dirty = set()      # VNIs changed since the last freeze()
+        self.version = 0
+
+    def __len__(self):
+        return len(self.vnis)
+
+    def __iter__(self):
+        return iter(self.vnis)
+
+    def __contains__(self, vni):
+        return vni in self.vnis
+
+    def entries(self):
+        """ Total number of <vni, addr> entries. """
+        return sum(len(members) for members in self.vnis.itervalues())
+
+    def get(self, vni, addr):
+        """ The ageout of <vni, addr>, or None if not in the fdb. """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        members = self.vnis.get(vni)
+        if members is None:
+            return None
+        i = members.find(addr)
+        if i < 0:
+            return None
+        return members.ageouts[i]
+
+    def add(self, vni, addr, ageout):
+        """
+        Add this <vni, addr> to the fdb.  Just updates the ageout if it
+        is already in the fdb.  Returns True if it was not.
+        """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        key = vni << 32 | addr
+        members = self.vnis.get(vni)
+        if members is None:
+            members = self.vnis[vni] = VniMembers()
+        i = bisect.bisect_left(members.addrs, addr)
+        if i < len(members.addrs) and members.addrs[i] == addr:
+            old = members.ageouts[i]
+            if old != ageout:
+                self._timer_cancel(old, key)
+                self._timer_add(ageout, key)
+                members.ageouts[i] = ageout
+                self.dirty.add(vni)
+            return False
+        self.dirty.add(vni)
+        members.addrs.insert(i, addr)
+        members.ageouts.insert(i, ageout)
+        self._timer_add(ageout, key)
+        return True
+
+    def remove(self, vni, addr):
+        """ Delete <vni, addr>.  Returns True if it was in the fdb. """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        ageout = self._delete(vni, addr)
+        if ageout is None:
+            return False
+        self._timer_cancel(ageout, vni << 32 | addr)
+        return True
+
+    def ageout(self, now, limit=None):
+        """
+        Delete every entry that aged out before now, or only about the
+        first limit of them if limit is given.  Returns a list of the
+        (vni, addr) deleted.  Scanning a VNI loaded from a snapshot can
+        take it over limit.
+        """
+
+        expired = []
+        while self.timer_heap and self.timer_heap[0] < now:
+            ageout = self.timer_heap[0]
+            bucket = self.timers[ageout]
+            while bucket:
+                if limit is not None and len(expired) >= limit:
+                    return expired
+                key = bucket.pop()
+                if key < 0:
+                    if ~key in self.unscanned:
+                        self._scan(~key, now, expired)
+                    continue
+                vni = key >> 32
+                addr = key & 0xffffffff
+                self._delete(vni, addr)
+                expired.append((vni, addr))
+            heapq.heappop(self.timer_heap)
+            del self.timers[ageout]
+        return expired
+
+    def addrs(self, vni):
+        """ List of the dotted decimal addresses in vni. """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        members = self.vnis.get(vni)
+        if members is None:
+            return []
+        return [ntoa(addr) for addr in members.addrs]
+
+    def ageouts(self, vni):
+        """ List of (dotted decimal address, ageout) in vni. """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        members = self.vnis.get(vni)
+        if members is None:
+            return []
+        return [(ntoa(addr), ageout)
+                for (addr, ageout) in zip(members.addrs, members.ageouts)]
+
+    def packed_addrs(self, vni):
+        """ The addresses in vni as a string of packed addresses. """
+
+        if vni in self.unscanned:
+            self._scan(vni, self.load_time, [])
+        members = self.vnis.get(vni)
+        if members is None:
+            return ''
+        if sys.byteorder == 'little':
+            addrs = array.array('I', members.addrs)
+            addrs.byteswap()
+            return addrs.tostring()
+        return members.addrs.tostring()
+
+    def rel_holdtime(self, now):
+        """
+        A copy of the fdb, fdb[vni] = {addr: holdtime, ...}, with the
+        hold times relative to now rather than absolute and addresses as
+        strings.  Used for display purposes.
+        """
+
+        for vni in list(self.unscanned):
+            self._scan(vni, self.load_time, [])
+        adjusted = {}
+        for (vni, members) in self.vnis.iteritems():
+            adjusted[vni] = dict((ntoa(addr), int(ageout - now))
+                                 for (addr, ageout) in zip(members.addrs,
+                                                           members.ageouts))
+        return adjusted
+
+    def snapshot(self):
+        """ The fdb as a string for load(). """
+
+        data = [_snap_hdr.pack(SNAPSHOT_MAGIC, len(self.vnis))]
+        for (vni, members) in self.vnis.iteritems():
+            # The arrays only differ in length if interrupted between
+            # updating one and the other, say by a signal on exit
+            cnt = min(len(members.addrs), len(members.ageouts))
+            data.append(_snap_vni.pack(vni, cnt))
+            data.append(members.addrs[:cnt].tostring())
+            data.append(members.ageouts[:cnt].tostring())
+        return ''.join(data)
+
+    def load(self, buf, now):
+        """
+        Load the entries from a snapshot() in buf, a string or mmap,
+        that don't age out before now.  The fdb must be empty.  Returns
+        the number of entries in the snapshot.
+        """
+
+        if self.vnis:
+            raise RuntimeError('Can only load a snapshot into an empty fdb')
+        if len(buf) < _snap_hdr.size:
+            raise RuntimeError('Snapshot is truncated')
+        (magic, cnt) = _snap_hdr.unpack_from(buf, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise RuntimeError('Not an fdb snapshot')
+        pos = _snap_hdr.size
+        vnis = {}
+        for i in xrange(cnt):
+            if pos + _snap_vni.size > len(buf):
+                raise RuntimeError('Snapshot is truncated')
+            (vni, length) = _snap_vni.unpack_from(buf, pos)
+            pos += _snap_vni.size
+            end = pos + length * 8
+            if end > len(buf):
+                raise RuntimeError('Snapshot is truncated')
+            members = VniMembers()
+            members.addrs.fromstring(buf[pos:pos + length * 4])
+            members.ageouts.fromstring(buf[pos + length * 4:end])
+            pos = end
+            if length:
+                vnis[vni] = members
+
+        entries = 0
+        for (vni, members) in vnis.iteritems():
+            self.vnis[vni] = members
+            self._timer_add(min(members.ageouts), ~vni)
+            entries += len(members)
+        self.unscanned = set(vnis)
+        self.load_time = now
+        self.dirty.update(vnis)
+        return entries
+
+    def freeze(self, prev=None):
+        """
+        A FrozenFdb of the fdb as it is now.  prev is the one returned
+        by the last call, if any, and the VNIs that haven't changed
+        since are shared with it rather than copied.
+        """
+
+        if prev is None:
+            vnis = {}
+            changed = self.vnis
+        else:
+            vnis = dict(prev.vnis)
+            changed = self.dirty
+        for vni in changed:
+            members = self.vnis.get(vni)
+            if members is None:
+                vnis.pop(vni, None)
+                continue
+            # Scanning a VNI loaded from a snapshot takes far longer
+            # than copying it, so leave that to the reader.  It skips
+            # the entries that had aged out by the load.
+            floor = self.load_time if vni in self.unscanned else 0
+            cnt = min(len(members.addrs), len(members.ageouts))
+            vnis[vni] = (members.addrs[:cnt].tostring(),
+                         members.ageouts[:cnt].tostring(), floor)
+        self.dirty = set()
+        self.version += 1
+        return FrozenFdb(vnis, self.version)
+
+    def _scan(self, vni, now, expired):
+        # Put the members of a VNI loaded from a snapshot in the expiry
+        # index, and delete the ones that age out before now.  Members
+        # already indexed just go in the same set again.
+        self.unscanned.discard(vni)
+        self.dirty.add(vni)
+        members = self.vnis.get(vni)
+        if members is None:
+            return
+        addrs = array.array('I')
+        ageouts = array.array('I')
+        for (addr, ageout) in zip(members.addrs, members.ageouts):
+            if ageout < now:
+                # Those gone before the load were never really here
+                if ageout >= self.load_time:
+                    expired.append((vni, addr))
+                continue
+            addrs.append(addr)
+            ageouts.append(ageout)
+            self._timer_add(ageout, vni << 32 | addr)
+        if not addrs:
+            del self.vnis[vni]
+            return
+        members.addrs = addrs
+        members.ageouts = ageouts
+
+    def _delete(self, vni, addr):
+        # Remove from the arrays and return the ageout it had
+        members = self.vnis.get(vni)
+        if members is None:
+            return None
+        i = members.find(addr)
+        if i < 0:
+            return None
+        ageout = members.ageouts[i]
+        self.dirty.add(vni)
+        del members.addrs[i]
+        del members.ageouts[i]
+        if not len(members):
+            del self.vnis[vni]
+        return ageout
+
+    def _timer_add(self, ageout, key):
+        bucket = self.timers.get(ageout)
+        if bucket is None:
+            bucket = self.timers[ageout] = set()
+            heapq.heappush(self.timer_heap, ageout)
+        bucket.add(key)
+
+    def _timer_cancel(self, ageout, key):
+        # An emptied set is left for ageout() to clean up
+        bucket = self.timers.get(ageout)
+        if bucket:
+            bucket.discard(key)
+
+
+class FrozenFdb(object):
+    """
+    An immutable copy of an Fdb made by Fdb.freeze(), safe to read from
+    any thread.  vnis[vni] = (addrs, ageouts, floor), the arrays as
+    strings and the entries with ageouts before floor left out.
+    """
+
+    __slots__ = ('vnis', 'version')
+
+    def __init__(self, vnis, version):
+        self.vnis = vnis
+        self.version = version
+
+    def __len__(self):
+        return len(self.vnis)
+
+    def __iter__(self):
+        return iter(self.vnis)
+
+    def __contains__(self, vni):
+        return vni in self.vnis
+
+    def entries(self):
+        """ Number of entries, including any below the floor. """
+        return sum(len(addrs) // 4
+                   for (addrs, ageouts, floor) in self.vnis.itervalues())
+
+    def query(self, low=0, high=0xffffffff, addr=None, after=None):
+        """
+        Yields (vni, addr, ageout), with integer addresses, for the
+        entries in the VNIs from low to high in order of VNI and
+        address.  Only those for addr if it is given.  after is the
+        (vni, addr) to start after, say the last from an earlier query.
+        A single VNI costs only the size of that VNI.
+        """
+
+        if after is not None:
+            low = max(low, after[0])
+        if low == high:
+            vnis = [low] if low in self.vnis else []
+        else:
+            vnis = sorted(vni for vni in self.vnis if low <= vni <= high)
+        for vni in vnis:
+            (addrs, ageouts, floor) = self.vnis[vni]
+            addrs = array.array('I', addrs)
+            ageouts = array.array('I', ageouts)
+            start = 0
+            if after is not None and vni == after[0]:
+                start = bisect.bisect_right(addrs, after[1])
+            if addr is None:
+                found = xrange(start, len(addrs))
+            else:
+                i = bisect.bisect_left(addrs, addr, start)
+                found = [i] if i < len(addrs) and addrs[i] == addr else []
+            for i in found:
+                if ageouts[i] >= floor:
+                    yield (vni, addrs[i], ageouts[i])
+
+    def rel_holdtime(self, now):
+        """ As Fdb.rel_holdtime(). """
+
+        adjusted = {}
+        for (vni, addr, ageout) in self.query():
+            adjusted.setdefault(vni, {})[ntoa(addr)] = int(ageout - now)
+        return adjusted
@@ -0,0 +1,151 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Flood packet construction
+
+A VXLAN pkt is flooded by wrapping it in new IP and UDP headers for
+each destination VTEP and sending the result on a raw socket.  The
+replicas of a pkt differ only in the IP destination address and the
+UDP checksum.  So the headers are built once per pkt in a reusable
+buffer, with the fields that never change filled in when the buffer is
+created, and each replica just rewrites those 6 bytes in place.
+
+The UDP checksum covers the destination address (via the pseudo
+header), so a partial sum of everything else is computed once per pkt
+and each replica's checksum is finished off from it with a couple of
+additions.
+
+The kernel fills in the IP total length and IP checksum on raw
+sockets, so those are left as 0.
+"""
+
+import array
+import socket
+import struct
+import sys
+
+IP_HDR_LEN = 20
+UDP_HDR_LEN = 8
+HDR_LEN = IP_HDR_LEN + UDP_HDR_LEN
+
+# Offset of the IP destination address.  Everything from here to the
+# end of the UDP header is specific to a replica.
+DST_OFFSET = 16
+
+_ip_fixed = struct.Struct('!BBHHHBB')   # ver/ihl ... protocol
+_udp_hdr = struct.Struct('!HHHH')       # sport, dport, len, cksum
+_tail = struct.Struct('!4sHHHH')        # dst addr and UDP header
+_cksum = struct.Struct('!H')
+_addr_words = struct.Struct('!HH')
+
+
+def _sum16(data):
+    """ 16 bit one's complement sum of data, not yet folded. """
+
+    if len(data) % 2:
+        data += '\x00'
+    words = array.array('H', data)
+    total = sum(words)
+    if sys.byteorder == 'little':
+        # Summing native words gives the byte swapped sum, fold first
+        # so that the swap is exact
+        total = _fold(total)
+        total = ((total & 0xff) << 8) | (total >> 8)
+    return total
+
+
+def _fold(total):
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+class FloodTemplate(object):
+    """
+    Reusable flood pkt for VXLAN pkts of up to size bytes sent to UDP
+    port dport.  Usage, for each received pkt:
+
+        template.load(pkt, src, sport)
+        for each destination:
+            sock.sendto(template.set_dst(dst), (dstip, 0))
+
+    Addresses are passed packed, as returned by inet_aton.
+    """
+
+    def __init__(self, dport, size, cksum=True, ttl=64):
+        self.dport = dport
+        self.cksum = cksum
+        self.buf = bytearray(HDR_LEN + size)
+        self.view = memoryview(self.buf)
+        _ip_fixed.pack_into(self.buf, 0, 0x45, 0, 0, 0, 0, ttl,
+                            socket.IPPROTO_UDP)
+        self.len = 0
+        self.sport = 0
+        self.ulen = 0
+        self.partial = 0
+
+    def load(self, pkt, src, sport):
+        """ Build the headers for pkt received from <src, sport>. """
+
+        self.sport = sport
+        self.ulen = UDP_HDR_LEN + len(pkt)
+        self.len = HDR_LEN + len(pkt)
+        self.buf[12:16] = src
+        _udp_hdr.pack_into(self.buf, IP_HDR_LEN, sport, self.dport,
+                           self.ulen, 0)
+        self.buf[HDR_LEN:self.len] = pkt
+        if self.cksum:
+            # Pseudo header without the destination, then the UDP
+            # header and payload.
+            self.partial = (_sum16(src) + socket.IPPROTO_UDP + self.ulen +
+                            sport + self.dport + self.ulen + _sum16(pkt))
+
+    def udp_cksum(self, dst):
+        """ The UDP checksum of the loaded pkt when sent to dst. """
+
+        if not self.cksum:
+            return 0
+        (hi, lo) = _addr_words.unpack(dst)
+        total = ~_fold(self.partial + hi + lo) & 0xffff
+        return total or 0xffff
+
+    def set_dst(self, dst):
+        """ Rewrite the loaded pkt for dst and return a view of it. """
+
+        self.buf[DST_OFFSET:IP_HDR_LEN] = dst
+        if self.cksum:
+            _cksum.pack_into(self.buf, HDR_LEN - 2, self.udp_cksum(dst))
+        return self.view[:self.len]
+
+    def head(self):
+        """ The part of the headers common to all replicas. """
+        return str(self.buf[:DST_OFFSET])
+
+    def tail(self, dst):
+        """
+        The part of the headers specific to the replica for dst.  The
+        full replica is head() + tail(dst) + pkt.  Used when replicas are
+        sent later with scatter/gather I/O and so can't share a buffer.
+        """
+
+        return _tail.pack(dst, self.sport, self.dport, self.ulen,
+                          self.udp_cksum(dst))
@@ -28,6 +28,14 @@ responds to these requests.  The response is two objects: the valid
 response if no error and an exception object if there is an error.
 One of the two should be None.
 
+Every msg either way is a pickle with its length in front, so neither
+side has to guess where one ends.  The server sends the response as
+(out, err, more).  A big response can be returned by process() as a
+Stream, which is sent a chunk at a time, each with more set, and then
+a last msg with the cursor for the next page in place of out.  The
+client can take the chunks one at a time as they arrive with stream(),
+so that neither side ever holds the whole response.
+
 See the test code for typical usage.
 """
 
@@ -41,6 +49,112 @@ import threading
 
 import pdb
 
+_len = struct.Struct('!I')
+
+CHUNK_SIZE = 1000   # items in each msg of a Stream
+
+
+def send_msg(sock, obj):
+    """ Send obj as one length prefixed msg. """
+
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_len.pack(len(data)))
+    sock.sendall(data)
+
+
+def recv_msg(sock):
+    """ Receive one length prefixed msg.  Returns None at EOF. """
+
+    hdr = _recv_exact(sock, _len.size)
+    if hdr is None:
+        return None
+    data = _recv_exact(sock, _len.unpack(hdr)[0])
+    if data is None:
+        raise RuntimeError('Truncated mgmt msg')
+    return pickle.loads(data)
+
+
+def _recv_exact(sock, size):
+    # Read into one buffer of the right size rather than joining
+    # strings, so big msgs take linear time
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        cnt = sock.recv_into(view[pos:], size - pos)
+        if not cnt:
+            if not pos:
+                return None
+            raise RuntimeError('Truncated mgmt msg')
+        pos += cnt
+    return str(buf)
+
+
+class Stream(object):
+    """
+    A response for process() to return to have it sent in chunks.
+    items yields (key, value) in key order, and each chunk is a list of
+    up to CHUNK_SIZE of them.  No more than limit items are sent, if
+    given.  If there were more, cursor is then the key of the last one
+    sent, for the client to ask for the next page with.
+    """
+
+    def __init__(self, items, limit=None):
+        self.items = items
+        self.limit = limit
+        self.cursor = None
+
+    def __iter__(self):
+        chunk = []
+        sent = 0
+        last = None
+        for (key, value) in self.items:
+            if sent == self.limit:
+                self.cursor = last
+                break
+            chunk.append((key, value))
+            last = key
+            sent += 1
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk or not sent:
+            yield chunk
+
+
+def query_filters(msg):
+    """
+    The filters of a query from one of the ctl programs, as (low, high,
+    addr, limit, cursor).  The VNIs wanted are those from low to high,
+    given as --vni=N or --vni=N-M.  addr, limit and cursor are None if
+    not given.  Raises RuntimeError for a bad one.
+    """
+
+    (low, high) = (0, 0xffffffff)
+    vnis = msg.get('--vni')
+    if vnis:
+        try:
+            parts = [int(part) for part in vnis.split('-', 1)]
+        except ValueError:
+            raise RuntimeError('Invalid VNI or VNI range %s' % vnis)
+        (low, high) = (parts[0], parts[-1])
+    addr = msg.get('--addr')
+    if addr:
+        try:
+            addr = socket.inet_ntoa(socket.inet_aton(addr))
+        except socket.error:
+            raise RuntimeError('Invalid address %s' % addr)
+    limit = msg.get('--limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise RuntimeError('Invalid limit %s' % limit)
+        if limit <= 0:
+            # Nothing would be sent, not even a cursor to go on from
+            raise RuntimeError('Invalid limit %d, must be at least 1' % limit)
+    return (low, high, addr or None, limit, msg.get('--cursor'))
+
 
 class MgmtServer(socket.socket):
 
@@ -84,23 +198,33 @@ class MgmtServer(socket.socket):
                 elif event & select.EPOLLIN:
                     client = self.clients[fileno]
                     try:
-                        buf = client.recv(4096)
-                        if not buf:   # EOF
-                            self.client_close(fileno)
-                            continue
-                    except socket.error as e:
+                        msg = recv_msg(client)
+                    except Exception:
+                        msg = None
+                    if msg is None:   # EOF or garbage
                         self.client_close(fileno)
+                        continue
 
-                    msg = pickle.loads(buf)
                     out, err = self.process(msg)
-                    output = pickle.dumps((out, err), pickle.HIGHEST_PROTOCOL)
-
                     try:
-                        client.sendall(struct.pack('I', len(output)))
-                        client.sendall(output)
+                        self.respond(client, out, err)
                     except socket.error as e:
                         self.client_close(fileno)
 
+    def respond(self, client, out, err):
+        if not isinstance(out, Stream):
+            send_msg(client, (out, err, False))
+            return
+        try:
+            for chunk in out:
+                send_msg(client, (chunk, None, True))
+        except socket.error:
+            raise
+        except Exception as e:
+            send_msg(client, (None, RuntimeError(str(e)), False))
+            return
+        send_msg(client, (out.cursor, None, False))
+
     def process(self, msg):
         # Returns a response object and an Exception object.  The
         # latter is None if no exception
@@ -127,21 +251,51 @@ class MgmtClient(socket.socket):
                   (uds_file, errno, string)
             raise RuntimeError(msg)
 
-    def sendobj(self, msgobj):
-        msg = pickle.dumps(msgobj, pickle.HIGHEST_PROTOCOL)
-
-        self.sendall(msg)
+        self.streaming = False
+        self.cursor = None
 
-        size = int(struct.unpack('I', self.recv(4))[0])
-        read_bytes = 0
-        resp = ""
-
-        while read_bytes < size:
-            resp += self.recv(2048)
-            read_bytes = len(resp)
+    def sendobj(self, msgobj):
+        """
+        Returns the whole response to msgobj as (out, err).  The chunks
+        of a Stream are joined into one list.
+        """
 
-        out, err = pickle.loads(resp)
-        return out, err
+        items = []
+        try:
+            for chunk in self.stream(msgobj):
+                if not self.streaming:
+                    return chunk, None
+                items.extend(chunk)
+        except RuntimeError as e:
+            return None, e
+        return items, None
+
+    def stream(self, msgobj):
+        """
+        Send msgobj and yield the response as it arrives.  A Stream
+        comes a chunk at a time, with streaming set, and afterwards
+        cursor is its cursor.  Anything else is yielded whole.  Raises
+        RuntimeError for an error response.
+        """
+
+        send_msg(self, msgobj)
+        self.streaming = False
+        self.cursor = None
+        while True:
+            resp = recv_msg(self)
+            if resp is None:
+                raise RuntimeError('Connection to daemon closed')
+            (out, err, more) = resp
+            if err:
+                raise RuntimeError(str(err))
+            if not more:
+                if self.streaming:
+                    self.cursor = out
+                else:
+                    yield out
+                return
+            self.streaming = True
+            yield out
 
 
 if __name__ == '__main__':
@@ -0,0 +1,220 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Batched datagram I/O
+
+Wrappers around the Linux recvmmsg(2) and sendmmsg(2) system calls so
+that a whole batch of datagrams can be received or sent with a single
+system call.  The socket module has no binding for these, so they are
+called through ctypes.  All the C structures are allocated once when
+the Receiver or Sender is created and are reused for every call.
+
+Use available() to check for support before creating either object.
+Only AF_INET sockets are supported.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+
+MSG_DONTWAIT = 0x40
+
+# Most messages the kernel will accept in a single call
+UIO_MAXIOV = 1024
+
+# Most pieces a datagram can be gathered from by Sender
+MAX_PARTS = 3
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_uint16),      # network byte order
+        ('sin_addr', ctypes.c_uint32),      # network byte order
+        ('sin_zero', ctypes.c_char * 8),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+_libc = None
+
+
+def _load():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                      ctypes.c_uint, ctypes.c_int,
+                                      ctypes.c_void_p]
+            libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                      ctypes.c_uint, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc
+
+
+def available():
+    """ True if the C library provides recvmmsg and sendmmsg. """
+    return bool(_load())
+
+
+def _addr_to_ip(addr):
+    return socket.inet_ntoa(struct.pack('=I', addr))
+
+
+def _ip_to_addr(ip):
+    return struct.unpack('=I', socket.inet_aton(ip))[0]
+
+
+class Receiver(object):
+    """ Receives up to count datagrams of at most bufsize bytes per call. """
+
+    def __init__(self, sock, count, bufsize):
+        if not available():
+            raise RuntimeError('recvmmsg is not supported')
+        self.sock = sock
+        self.count = min(count, UIO_MAXIOV)
+        self.bufs = [ctypes.create_string_buffer(bufsize)
+                     for i in range(self.count)]
+        self.iovs = (iovec * self.count)()
+        self.names = (sockaddr_in * self.count)()
+        self.msgs = (mmsghdr * self.count)()
+        for i in range(self.count):
+            self.iovs[i].iov_base = ctypes.addressof(self.bufs[i])
+            self.iovs[i].iov_len = bufsize
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.names[i])
+            hdr.msg_iov = ctypes.pointer(self.iovs[i])
+            hdr.msg_iovlen = 1
+
+    def recv(self):
+        """
+        Returns a list of (pkt, (srcip, srcport)) tuples, the same as
+        recvfrom would return for each datagram.  The list is empty if
+        nothing was waiting on the socket.
+        """
+
+        for i in range(self.count):
+            self.msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+        cnt = _libc.recvmmsg(self.sock.fileno(), self.msgs, self.count,
+                             MSG_DONTWAIT, None)
+        if cnt < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise socket.error(err, os.strerror(err))
+
+        result = []
+        for i in range(cnt):
+            name = self.names[i]
+            addr = (_addr_to_ip(name.sin_addr), socket.ntohs(name.sin_port))
+            pkt = ctypes.string_at(self.bufs[i], self.msgs[i].msg_len)
+            result.append((pkt, addr))
+        return result
+
+
+class Sender(object):
+    """ Sends a list of datagrams with as few calls as possible. """
+
+    def __init__(self, sock, count=UIO_MAXIOV):
+        if not available():
+            raise RuntimeError('sendmmsg is not supported')
+        self.sock = sock
+        self.count = min(count, UIO_MAXIOV)
+        self.iovs = (iovec * (self.count * MAX_PARTS))()
+        self.names = (sockaddr_in * self.count)()
+        self.msgs = (mmsghdr * self.count)()
+        for i in range(self.count):
+            self.names[i].sin_family = socket.AF_INET
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.names[i])
+            hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self.iovs[i * MAX_PARTS])
+
+    def send(self, datagrams):
+        """
+        Send each (data, (dstip, dstport)) in datagrams.  data is a
+        string or a tuple of up to MAX_PARTS strings which are sent
+        back to back as one datagram.  The strings are referenced in
+        place, not copied.  A datagram the kernel refuses is dropped and
+        sending carries on with the next one.  Returns the number of
+        datagrams sent.
+        """
+
+        sent = 0
+        fd = self.sock.fileno()
+        for base in range(0, len(datagrams), self.count):
+            chunk = datagrams[base:base + self.count]
+            for (i, (data, (ip, port))) in enumerate(chunk):
+                if not isinstance(data, tuple):
+                    data = (data,)
+                for (j, part) in enumerate(data):
+                    iov = self.iovs[i * MAX_PARTS + j]
+                    iov.iov_base = ctypes.cast(ctypes.c_char_p(part),
+                                               ctypes.c_void_p).value
+                    iov.iov_len = len(part)
+                self.msgs[i].msg_hdr.msg_iovlen = len(data)
+                self.names[i].sin_addr = _ip_to_addr(ip)
+                self.names[i].sin_port = socket.htons(port)
+            pos = 0
+            while pos < len(chunk):
+                cnt = _libc.sendmmsg(fd, ctypes.byref(self.msgs[pos]),
+                                     len(chunk) - pos, 0)
+                if cnt <= 0:
+                    if ctypes.get_errno() == errno.EINTR:
+                        continue
+                    # Skip the datagram that failed
+                    cnt = 1
+                else:
+                    sent += cnt
+                pos += cnt
+        return sent
@@ -0,0 +1,136 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Profiling a running daemon
+
+A Profiler runs cProfile over a daemon's main loop when asked to by
+the mgmt thread, for a set time or until asked to stop, and then keeps
+the report of the functions the time went in.
+
+cProfile only profiles the thread that enables it, so the mgmt thread
+can't just turn it on.  Instead it sets what it wants and writes to a
+pipe to wake the main loop, which has the Profiler in its select list
+and calls poll() each time round.  poll() does the enabling and
+disabling.  While the profiler is off that is all it costs: a call and
+a few attribute tests per loop.
+"""
+
+import cProfile
+import errno
+import fcntl
+import os
+import pstats
+import StringIO
+import threading
+import time
+
+DURATION = 30       # default secs to profile for
+REPORT_LINES = 40   # functions in the report
+STOP_WAIT = 5       # secs for stop() to wait for the main loop
+
+
+class Profiler(object):
+    """ cProfile of the main loop, for the mgmt thread to turn on. """
+
+    def __init__(self):
+        self.wanted = False
+        self.stop_time = 0
+        self.pending = False
+        self.profile = None     # main loop's, while profiling
+        self.report = None
+        self.done = threading.Event()
+        (self.rfd, self.wfd) = os.pipe()
+        flags = fcntl.fcntl(self.rfd, fcntl.F_GETFL)
+        fcntl.fcntl(self.rfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.rfd
+
+    def wake_time(self):
+        """ When the main loop must next call poll(), or None. """
+        return self.stop_time if self.profile is not None else None
+
+    def command(self, msg):
+        """
+        Carry out the profile start or stop in a msg from a ctl
+        program.  Returns the text to show.
+        """
+
+        if msg.get('start'):
+            try:
+                duration = float(msg.get('--duration') or DURATION)
+            except ValueError:
+                raise RuntimeError('Invalid duration %s' % msg['--duration'])
+            self.start(duration)
+            return 'Profiling for %g secs' % duration
+        return self.stop()
+
+    def start(self, duration):
+        self.stop_time = time.time() + duration
+        self.report = None
+        self.done.clear()
+        self.wanted = True
+        self._wake()
+
+    def stop(self):
+        """
+        Stop profiling, if it still is, and return the report.  Raises
+        RuntimeError if there is none.
+        """
+
+        if self.wanted:
+            self.wanted = False
+            self._wake()
+            self.done.wait(STOP_WAIT)
+        if self.report is None:
+            raise RuntimeError('Not profiling')
+        return self.report
+
+    def poll(self):
+        """ Called by the main loop to start or stop as asked. """
+
+        if self.pending:
+            self.pending = False
+            try:
+                os.read(self.rfd, 4096)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        if self.profile is None:
+            if self.wanted:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+        elif not self.wanted or time.time() >= self.stop_time:
+            self.profile.disable()
+            out = StringIO.StringIO()
+            ps = pstats.Stats(self.profile, stream=out)
+            ps.sort_stats('tottime').print_stats(REPORT_LINES)
+            self.report = out.getvalue()
+            self.profile = None
+            self.wanted = False
+            self.done.set()
+
+    def _wake(self):
+        # Written before pending is set so that the main loop can't
+        # clear pending and then miss the byte
+        os.write(self.wfd, 'x')
+        self.pending = True
@@ -0,0 +1,77 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Token bucket rate limits
+
+A RateLimiter keeps a token bucket per key, say a source address or a
+VNI.  Each bucket fills at rate tokens a sec up to a burst of one
+sec's worth, or of one token if rate is less than that, and each thing
+let through takes a token.
+
+A bucket that has been left alone long enough to fill up is no
+different from a new one, so when there are more than max_keys buckets
+the full ones are thrown away.  That keeps a flood of pkts from made
+up source addresses from using up memory.
+"""
+
+MAX_KEYS = 65536
+
+
+class RateLimiter(object):
+    """ A token bucket of rate per sec for each key. """
+
+    def __init__(self, rate, max_keys=MAX_KEYS):
+        if rate <= 0:
+            raise RuntimeError('Invalid rate %s' % rate)
+        self.rate = float(rate)
+        self.burst = max(self.rate, 1)
+        self.max_keys = max_keys
+        self.buckets = {}   # key -> [tokens, time last filled]
+
+    def allow(self, key, now):
+        """ Take a token from key's bucket.  False if there were none. """
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.prune(now)
+            self.buckets[key] = [self.burst - 1, now]
+            return True
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def prune(self, now):
+        """
+        Throw away the buckets that have filled up.  If that isn't
+        enough, start again with none.
+        """
+
+        for (key, (tokens, last)) in self.buckets.items():
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
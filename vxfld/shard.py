@@ -0,0 +1,110 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Consistent hash ring of service nodes
+
+A Ring assigns each VNI to a few owners out of a set of service node
+addresses.  Each address is hashed to VNODES points on a ring of 32
+bit values, and the owners of a VNI are the first replicas distinct
+addresses at or after the VNI's own hash going round the ring.
+
+Every node with the same addresses and replicas works out the same
+owners.  Adding an address only moves to it the VNIs whose points it
+lands in front of, about 1/n of them, rather than reshuffling the lot.
+
+Addresses can be marked down, and live_owner() skips them.  The marks
+are kept in shared memory, so processes forked after the Ring is made
+see each other's.
+
+The owners of the VNIs looked up most recently are cached.  VNIs come
+off the wire, so when the cache reaches MAX_CACHE VNIs it is started
+again with none, rather than letting made up VNIs grow it without
+bound.  A Ring's addresses never change.  A new set of them means a
+new Ring, with an empty cache.
+"""
+
+import bisect
+import hashlib
+import mmap
+import struct
+
+VNODES = 128    # points on the ring per address
+MAX_CACHE = 65536
+
+
+def _hash(key):
+    return struct.unpack_from('>I', hashlib.md5(key).digest())[0]
+
+
+class Ring(object):
+    """ The owners of each VNI among addrs, replicas of them each. """
+
+    def __init__(self, addrs, replicas, vnodes=VNODES, max_cache=MAX_CACHE):
+        if replicas < 1:
+            raise RuntimeError('Invalid number of replicas %s' % replicas)
+        self.addrs = sorted(set(addrs))
+        self.replicas = min(replicas, len(self.addrs))
+        points = sorted((_hash('%s/%d' % (addr, i)), addr)
+                        for addr in self.addrs for i in xrange(vnodes))
+        self.hashes = [point[0] for point in points]
+        self.points = [point[1] for point in points]
+        self.cache = {}     # vni -> owners
+        self.max_cache = max_cache
+        self.index = dict((addr, i) for (i, addr) in enumerate(self.addrs))
+        self.down = mmap.mmap(-1, max(len(self.addrs), 1))  # byte per addr
+
+    def owners(self, vni):
+        """ The tuple of addrs that own vni, in ring order. """
+
+        try:
+            return self.cache[vni]
+        except KeyError:
+            pass
+        owners = []
+        if self.points:
+            pos = bisect.bisect_left(self.hashes, _hash(struct.pack('>I',
+                                                                    vni)))
+            for i in xrange(len(self.points)):
+                addr = self.points[(pos + i) % len(self.points)]
+                if addr not in owners:
+                    owners.append(addr)
+                    if len(owners) == self.replicas:
+                        break
+        if len(self.cache) >= self.max_cache:
+            self.cache.clear()
+        owners = self.cache[vni] = tuple(owners)
+        return owners
+
+    def live_owner(self, vni):
+        """ The first owner of vni that isn't down, else the first. """
+
+        owners = self.owners(vni)
+        for addr in owners:
+            if self.down[self.index[addr]] == '\0':
+                return addr
+        return owners[0] if owners else None
+
+    def is_down(self, addr):
+        return self.down[self.index[addr]] != '\0'
+
+    def set_down(self, addr, down):
+        self.down[self.index[addr]] = '\1' if down else '\0'
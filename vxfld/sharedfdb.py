@@ -0,0 +1,127 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Forwarding DB membership shared between processes
+
+One process (the writer) owns the fdb and publishes its membership
+into an anonymous shared mmap.  Any number of forked processes can
+then read it.  The object must be created before forking.
+
+The mmap holds a header followed by two slots.  The header is the
+generation number of the current publication and the slot in use is
+generation % 2.  The writer always fills the other slot, so a reader
+parsing the current slot is never overwritten unless the writer has
+published twice in the mean time.  Readers detect that by checking
+the generation again after parsing and simply try again.
+
+Each slot starts with its own generation number and data length,
+followed by the membership encoded as:
+
+    vni (4 bytes), count (4 bytes), count * 4 bytes packed addresses
+"""
+
+import mmap
+import struct
+
+_gen = struct.Struct('=I')
+_slot_hdr = struct.Struct('=II')     # generation, data length
+_vni_hdr = struct.Struct('=II')      # vni, address count
+
+
+class SharedFdb(object):
+    """ Shared fdb membership table of size bytes. """
+
+    def __init__(self, size):
+        self.slot_size = (size - _gen.size) // 2
+        if self.slot_size <= _slot_hdr.size:
+            raise RuntimeError('Shared fdb size %d is too small' % size)
+        self.mm = mmap.mmap(-1, size)
+
+        # The reader's cached copy
+        self.gen = 0
+        self.fdb = FdbView()
+
+    def _slot(self, gen):
+        return _gen.size + (gen % 2) * self.slot_size
+
+    def publish(self, fdb):
+        """ Writer side.  Publish the membership of a vxfld.fdb.Fdb. """
+
+        data = []
+        # A copy, as packed_addrs() drops a VNI loaded from a snapshot
+        # if all its members have aged out since
+        for vni in list(fdb):
+            packed = fdb.packed_addrs(vni)
+            data.append(_vni_hdr.pack(vni, len(packed) // 4))
+            data.append(packed)
+        data = ''.join(data)
+        if _slot_hdr.size + len(data) > self.slot_size:
+            raise RuntimeError('Forwarding DB too large for shared fdb '
+                               '(%d bytes)' % len(data))
+
+        gen = _gen.unpack_from(self.mm, 0)[0] + 1
+        off = self._slot(gen)
+        self.mm[off + _slot_hdr.size:off + _slot_hdr.size + len(data)] = data
+        _slot_hdr.pack_into(self.mm, off, gen, len(data))
+        # Make it current
+        _gen.pack_into(self.mm, 0, gen)
+
+    def view(self):
+        """
+        Reader side.  Returns the current membership as an FdbView.
+        Only parses the table when it has changed since the last call.
+        The result must not be modified.
+        """
+
+        gen = _gen.unpack_from(self.mm, 0)[0]
+        while gen != self.gen:
+            off = self._slot(gen)
+            (slot_gen, length) = _slot_hdr.unpack_from(self.mm, off)
+            if slot_gen == gen:
+                fdb = self._parse(off + _slot_hdr.size, length)
+                if _gen.unpack_from(self.mm, 0)[0] == gen:
+                    self.gen = gen
+                    self.fdb = fdb
+                    break
+            # Writer got in the way.  Try again.
+            gen = _gen.unpack_from(self.mm, 0)[0]
+        return self.fdb
+
+    def _parse(self, pos, length):
+        fdb = FdbView()
+        mm = self.mm
+        end = pos + length
+        while pos + _vni_hdr.size <= end:
+            (vni, cnt) = _vni_hdr.unpack_from(mm, pos)
+            pos += _vni_hdr.size
+            if pos + cnt * 4 > end:
+                break
+            fdb[vni] = mm[pos:pos + cnt * 4]
+            pos += cnt * 4
+        return fdb
+
+
+class FdbView(dict):
+    """ Published membership, view[vni] = packed addresses. """
+
+    def packed_addrs(self, vni):
+        return self.get(vni, '')
@@ -0,0 +1,331 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+Counters and histograms
+
+A Stats object holds a daemon's:
+
+    counters[name] = count
+    labelled[name] = (label, {value: count}), a counter split by label
+                     into at most cap values if given, the rest being
+                     counted together as OTHER
+    histograms[name] = Histogram
+    gauges[name] = function returning the current value
+
+Counting is just a dict increment, so it is cheap enough for the flood
+path.  Nothing is locked.  state() takes a copy that is safe to hand to
+another thread, as copying a dict is atomic.
+
+prometheus() formats a state() in the Prometheus text format, and
+Exporter serves it over HTTP for Prometheus to scrape.
+"""
+
+import BaseHTTPServer
+import bisect
+import collections
+import threading
+import time
+
+# Bucket bounds, in seconds, for timing the main loops and locks
+LATENCY_BOUNDS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                  0.5, 1, 2.5, 5, 10)
+
+
+OTHER = 'other'     # label value for counts over a labelled counter's cap
+
+
+class CappedCounts(dict):
+    """
+    Counts, like a defaultdict(int), of up to cap values.  Values after
+    that are counted as OTHER, so made up values can't grow it without
+    bound.
+    """
+
+    def __init__(self, cap):
+        dict.__init__(self)
+        self.cap = cap
+
+    def __missing__(self, key):
+        return 0
+
+    def __setitem__(self, key, cnt):
+        # A new key's count starts from 0, so cnt is all it adds
+        if key not in self and len(self) >= self.cap:
+            cnt += self.get(OTHER, 0)
+            key = OTHER
+        dict.__setitem__(self, key, cnt)
+
+
+class Histogram(object):
+    """
+    Counts of the values observed, counts[i] being those no more than
+    bounds[i] and not in an earlier bucket, and the last those over
+    all the bounds.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def state(self):
+        return {'bounds': self.bounds, 'counts': list(self.counts),
+                'sum': self.sum}
+
+    def merge(self, state):
+        if tuple(state['bounds']) != self.bounds:
+            raise RuntimeError('Histogram bounds differ')
+        for (i, cnt) in enumerate(state['counts']):
+            self.counts[i] += cnt
+        self.sum += state['sum']
+
+    def clear(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+
+
+class Stats(object):
+    """ A daemon's counters, histograms and gauges. """
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.labelled = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def by(self, name, label, cap=None):
+        """
+        The dict of counts for counter name split by label, to be
+        incremented directly.  Always the same dict for the name.  With
+        a cap, it is a CappedCounts.
+        """
+
+        try:
+            return self.labelled[name][1]
+        except KeyError:
+            if cap:
+                counts = CappedCounts(cap)
+            else:
+                counts = collections.defaultdict(int)
+            self.labelled[name] = (label, counts)
+            return counts
+
+    def histogram(self, name, bounds=LATENCY_BOUNDS):
+        """ The Histogram called name, made on first use. """
+
+        try:
+            return self.histograms[name]
+        except KeyError:
+            hist = self.histograms[name] = Histogram(bounds)
+            return hist
+
+    def gauge(self, name, func):
+        """ Report func() as the value of name. """
+
+        self.gauges[name] = func
+
+    def state(self):
+        """ A copy of the lot, with the gauges read. """
+
+        gauges = {}
+        for (name, func) in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception:
+                pass
+        return {
+            'counters': dict(self.counters),
+            'labelled': dict((name, (label, dict(counts)))
+                             for (name, (label, counts))
+                             in self.labelled.items()),
+            'histograms': dict((name, hist.state())
+                               for (name, hist) in self.histograms.items()),
+            'gauges': gauges,
+        }
+
+    def take(self):
+        """
+        state() without the gauges, and start counting from zero again.
+        For a process that reports to another, which merge()s them.
+        """
+
+        state = self.state()
+        del state['gauges']
+        self.counters.clear()
+        for (label, counts) in self.labelled.values():
+            counts.clear()
+        for hist in self.histograms.values():
+            hist.clear()
+        return state
+
+    def merge(self, state):
+        """
+        Add in the counts taken from another process.  Any part of the
+        state may be left out.
+        """
+
+        for (name, cnt) in state.get('counters', {}).items():
+            self.counters[name] += cnt
+        for (name, (label, counts)) in state.get('labelled', {}).items():
+            mine = self.by(name, label)
+            for (value, cnt) in counts.items():
+                mine[value] += cnt
+        for (name, hist) in state.get('histograms', {}).items():
+            self.histogram(name, hist['bounds']).merge(hist)
+
+
+class TimedLock(object):
+    """
+    A threading.Lock that records in histograms of stats how long each
+    acquire() waits for it, as lock_wait_seconds, and how long it is
+    then held, as lock_hold_seconds.
+    """
+
+    def __init__(self, stats):
+        self.lock = threading.Lock()
+        self.wait = stats.histogram('lock_wait_seconds')
+        self.hold = stats.histogram('lock_hold_seconds')
+        self.acquired = 0
+
+    def acquire(self):
+        start = time.time()
+        self.lock.acquire()
+        self.acquired = time.time()
+        self.wait.observe(self.acquired - start)
+
+    def release(self):
+        self.hold.observe(time.time() - self.acquired)
+        self.lock.release()
+
+
+def prometheus(state, prefix):
+    """ A state() in the Prometheus text format, names with prefix_. """
+
+    lines = []
+    for (name, cnt) in sorted(state['counters'].items()):
+        name = '%s_%s_total' % (prefix, name)
+        lines.append('# TYPE %s counter' % name)
+        lines.append('%s %s' % (name, cnt))
+    for (name, (label, counts)) in sorted(state['labelled'].items()):
+        name = '%s_%s_total' % (prefix, name)
+        lines.append('# TYPE %s counter' % name)
+        for (value, cnt) in sorted(counts.items()):
+            lines.append('%s{%s="%s"} %s' % (name, label, value, cnt))
+    for (name, hist) in sorted(state['histograms'].items()):
+        name = '%s_%s' % (prefix, name)
+        lines.append('# TYPE %s histogram' % name)
+        total = 0
+        for (bound, cnt) in zip(hist['bounds'] + ('+Inf',), hist['counts']):
+            total += cnt
+            lines.append('%s_bucket{le="%s"} %d' % (name, bound, total))
+        lines.append('%s_sum %s' % (name, hist['sum']))
+        lines.append('%s_count %d' % (name, total))
+    for (name, value) in sorted(state.get('gauges', {}).items()):
+        name = '%s_%s' % (prefix, name)
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def text(state, top=10):
+    """
+    A state() as text for people to read.  Only the top counts of each
+    labelled counter are shown.
+    """
+
+    lines = []
+    values = dict(state['counters'])
+    values.update(state.get('gauges', {}))
+    for (name, value) in sorted(values.items()):
+        lines.append('%-32s %s' % (name, value))
+    for (name, (label, counts)) in sorted(state['labelled'].items()):
+        lines.append('%s (top %d by %s):' % (name, top, label))
+        counts = sorted(counts.items(), key=lambda item: -item[1])
+        for (value, cnt) in counts[:top]:
+            lines.append('    %-28s %s' % (value, cnt))
+    for (name, hist) in sorted(state['histograms'].items()):
+        cnt = sum(hist['counts'])
+        if not cnt:
+            lines.append('%-32s count 0' % name)
+            continue
+        lines.append('%-32s count %d, mean %.6f, p50 <= %s, p99 <= %s' %
+                     (name, cnt, hist['sum'] / cnt, _quantile(hist, 0.5),
+                      _quantile(hist, 0.99)))
+    return '\n'.join(lines)
+
+
+def _quantile(hist, q):
+    # The upper bound of the bucket the q quantile falls in
+    want = q * sum(hist['counts'])
+    total = 0
+    for (bound, cnt) in zip(hist['bounds'] + ('+Inf',), hist['counts']):
+        total += cnt
+        if total >= want:
+            return bound
+    return '+Inf'
+
+
+class Exporter(BaseHTTPServer.HTTPServer):
+    """
+    Serves the stats in the Prometheus text format at /metrics on port,
+    from a thread of its own.
+    """
+
+    def __init__(self, port, stats, prefix):
+        self.stats = stats
+        self.prefix = prefix
+        try:
+            BaseHTTPServer.HTTPServer.__init__(self, ('', port),
+                                               _MetricsHandler)
+        except Exception as e:
+            raise RuntimeError('Unable to serve metrics on port %d: %s' %
+                               (port, str(e)))
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus(self.server.stats.state(), self.server.prefix)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        # Not to stderr, which may be gone once daemonized
+        pass
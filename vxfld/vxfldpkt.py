@@ -33,6 +33,28 @@ class MsgType():
     unknown = 0  # Never used
     refresh = 1
     resend = 2
+    delta = 3
+
+
+class Flags():
+    # Bits in the originator field
+    originator = 0x0001
+    # The last VNI's list is continued in the next msg, or in a sync
+    # delta, more pages of the dump follow
+    more = 0x0002
+    sync = 0x0004  # delta is part of a full dump, not a change
+    # Refresh forwarded for a VNI the sender doesn't own.  Reply with
+    # the VNI's list for it to relay.
+    proxy = 0x0008
+
+
+# Bytes of IP and UDP header in front of every msg.  Used when fitting
+# msgs to an MTU.
+IP_UDP_HDR_LEN = 28
+
+_vni_hdr = struct.Struct('>IH')     # vni, address count
+_delta_hdr = struct.Struct('>IHH')  # vni, added count, deleted count
+_type = struct.Struct('>BB')        # version, type
 
 
 class PktError(Exception):
@@ -57,32 +79,83 @@ class Refresh(dpkt.Packet):
             self.unpack(args[0])
 
     def unpack(self, buf):
-        dpkt.Packet.unpack(self, buf)
+        # Decoded straight from buf, without slicing off the payload or
+        # each VNI's record.
+        if len(buf) < self.__hdr_len__:
+            raise PktError("Short packet")
+        hdr = struct.unpack_from(self.__hdr_fmt__, buf)
+        for (field, val) in zip(self.__hdr_fields__, hdr):
+            setattr(self, field, val)
         if self.version != version:
             raise PktError("Wrong version")
-        data = self.data
-        pos = 0
-        data_len = len(data)
+        pos = self.__hdr_len__
+        data_len = len(buf)
+        self.last_vni = None
         while pos < data_len:
-            (vni, cnt) = struct.unpack('>IH', data[pos:pos + 6])
-            pos += 6
-            if pos + cnt * 4 > data_len:
+            if pos + _vni_hdr.size > data_len:
                 raise PktError("Short packet")
-            if not self.vni_vteps.get(vni, None):
-                self.vni_vteps[vni] = []
-            while cnt:
-                ip = data[pos:pos + 4]
-                self.vni_vteps[vni].append(socket.inet_ntoa(ip))
-                cnt -= 1
-                pos += 4
+            (vni, cnt) = _vni_hdr.unpack_from(buf, pos)
+            pos += _vni_hdr.size
+            end = pos + cnt * 4
+            if end > data_len:
+                raise PktError("Short packet")
+            iplist = self.vni_vteps.setdefault(vni, [])
+            iplist.extend(socket.inet_ntoa(buf[p:p + 4])
+                          for p in xrange(pos, end, 4))
+            pos = end
+            self.last_vni = vni
 
     def __str__(self):
-        s = ''
+        return self.encode()[0]
+
+    def encode(self, mtu=None):
+        """
+        Returns the pkt as a list of datagrams, each of which fits in
+        mtu bytes including the IP and UDP headers.  With no mtu the
+        list has just the one datagram.  A VNI with too many addresses
+        to fit is continued in the next datagram, with the more flag
+        set in the one before.  All are built in one preallocated buffer.
+        """
+
+        if mtu is None:
+            size = len(self)
+        else:
+            size = mtu - IP_UDP_HDR_LEN
+            if size < self.__hdr_len__ + _vni_hdr.size + 4:
+                raise PktError("MTU %d too small" % mtu)
+        buf = bytearray(size)
+        datagrams = []
+        pos = self.__hdr_len__
+
+        def flush(pos, flags):
+            struct.pack_into(self.__hdr_fmt__, buf, 0, self.version,
+                             self.type, flags, self.holdtime)
+            datagrams.append(str(buf[:pos]))
+
         for (vni, iplist) in self.vni_vteps.items():
-            s += struct.pack('>IH', vni, len(iplist))
-            for ip in iplist:
-                s += socket.inet_aton(ip)
-        return self.pack_hdr() + s
+            start = 0
+            while True:
+                # Room for the VNI and at least one address?
+                need = _vni_hdr.size + min(len(iplist) - start, 1) * 4
+                if pos + need > size and pos > self.__hdr_len__:
+                    flush(pos, self.originator)
+                    pos = self.__hdr_len__
+                cnt = min(len(iplist) - start,
+                          (size - pos - _vni_hdr.size) // 4)
+                _vni_hdr.pack_into(buf, pos, vni, cnt)
+                pos += _vni_hdr.size
+                for ip in iplist[start:start + cnt]:
+                    buf[pos:pos + 4] = socket.inet_aton(ip)
+                    pos += 4
+                start += cnt
+                if start >= len(iplist):
+                    break
+                # Out of room, the rest of this VNI goes in the next
+                flush(pos, self.originator | Flags.more)
+                pos = self.__hdr_len__
+        if pos > self.__hdr_len__ or not datagrams:
+            flush(pos, self.originator)
+        return datagrams
 
     def __len__(self):
         cnt = 0
@@ -99,3 +172,165 @@ class Refresh(dpkt.Packet):
                 iplist.extend(l)
             else:
                 self.vni_vteps[vni] = l
+
+
+class Delta(dpkt.Packet):
+    """
+    Packet sent between vxsnd peers carrying only the changes to the
+    vvtuples: adds[vni] = [ip, ...] and dels[vni] = [ip, ...].
+
+    Every datagram a vxsnd sends to its peers takes the next seqno, so
+    a receiver that sees a seqno other than one more than the last
+    from that peer knows it has missed a change.  A delta with nothing
+    in it serves as a keepalive.
+
+    A full dump, sent in response to a resend, is a series of pages
+    with the sync flag set.  They all carry the seqno of the last change
+    sent before the dump and are numbered from page 0.  All but the last
+    page have the more flag set.
+    """
+
+    __hdr__ = (
+        ('version', 'B', 0x01),
+        ('type', 'B', MsgType.delta),
+        ('flags', 'H', 0),
+        ('holdtime', 'H', 0),
+        ('seqno', 'I', 0),
+        ('page', 'H', 0)    # sync only
+    )
+
+    def __init__(self, *args, **kwargs):
+        dpkt.Packet.__init__(self, **kwargs)
+        self.adds = dict()
+        self.dels = dict()
+        if args:
+            self.unpack(args[0])
+
+    def unpack(self, buf):
+        if len(buf) < self.__hdr_len__:
+            raise PktError("Short packet")
+        hdr = struct.unpack_from(self.__hdr_fmt__, buf)
+        for (field, val) in zip(self.__hdr_fields__, hdr):
+            setattr(self, field, val)
+        if self.version != version:
+            raise PktError("Wrong version")
+        pos = self.__hdr_len__
+        data_len = len(buf)
+        while pos < data_len:
+            if pos + _delta_hdr.size > data_len:
+                raise PktError("Short packet")
+            (vni, nadd, ndel) = _delta_hdr.unpack_from(buf, pos)
+            pos += _delta_hdr.size
+            end = pos + (nadd + ndel) * 4
+            if end > data_len:
+                raise PktError("Short packet")
+            mid = pos + nadd * 4
+            if nadd:
+                self.adds.setdefault(vni, []).extend(
+                    socket.inet_ntoa(buf[p:p + 4])
+                    for p in xrange(pos, mid, 4))
+            if ndel:
+                self.dels.setdefault(vni, []).extend(
+                    socket.inet_ntoa(buf[p:p + 4])
+                    for p in xrange(mid, end, 4))
+            pos = end
+
+    def __str__(self):
+        return self.encode()[0]
+
+    def __len__(self):
+        cnt = 0
+        for vni in set(self.adds) | set(self.dels):
+            cnt += _delta_hdr.size + 4 * (len(self.adds.get(vni, ())) +
+                                          len(self.dels.get(vni, ())))
+        return self.__hdr_len__ + cnt
+
+    def encode(self, mtu=None):
+        """
+        Returns the pkt as a list of datagrams, each of which fits in
+        mtu bytes including the IP and UDP headers.  The first has
+        seqno and each one after it the next seqno.  In a sync delta
+        they all have seqno and it is the page that counts up instead.
+        The last datagram has the more flag only if the pkt has.  A VNI
+        with too many changes to fit is simply continued in a record of
+        its own in the next.
+        """
+
+        if mtu is None:
+            size = len(self)
+        else:
+            size = mtu - IP_UDP_HDR_LEN
+            if size < self.__hdr_len__ + _delta_hdr.size + 4:
+                raise PktError("MTU %d too small" % mtu)
+        buf = bytearray(size)
+        datagrams = []
+        pos = self.__hdr_len__
+        sync = self.flags & Flags.sync
+
+        def flush(pos, last=False):
+            cnt = len(datagrams)
+            if sync:
+                (seqno, page) = (self.seqno, self.page + cnt)
+                flags = self.flags if last else self.flags | Flags.more
+            else:
+                (seqno, page) = ((self.seqno + cnt) & 0xffffffff, 0)
+                flags = self.flags
+            struct.pack_into(self.__hdr_fmt__, buf, 0, self.version,
+                             self.type, flags, self.holdtime, seqno, page)
+            datagrams.append(str(buf[:pos]))
+
+        for vni in set(self.adds) | set(self.dels):
+            adds = self.adds.get(vni, [])
+            dels = self.dels.get(vni, [])
+            (a, d) = (0, 0)
+            while a < len(adds) or d < len(dels):
+                if pos + _delta_hdr.size + 4 > size:
+                    flush(pos)
+                    pos = self.__hdr_len__
+                room = (size - pos - _delta_hdr.size) // 4
+                nadd = min(len(adds) - a, room)
+                ndel = min(len(dels) - d, room - nadd)
+                _delta_hdr.pack_into(buf, pos, vni, nadd, ndel)
+                pos += _delta_hdr.size
+                for ip in adds[a:a + nadd] + dels[d:d + ndel]:
+                    buf[pos:pos + 4] = socket.inet_aton(ip)
+                    pos += 4
+                a += nadd
+                d += ndel
+        flush(pos, True)
+        return datagrams
+
+
+class Resend(dpkt.Packet):
+    """Request to a vxsnd peer to send a full dump of its vvtuples."""
+
+    __hdr__ = (
+        ('version', 'B', 0x01),
+        ('type', 'B', MsgType.resend),
+        ('flags', 'H', 0),
+        ('holdtime', 'H', 0)
+    )
+
+    def unpack(self, buf):
+        dpkt.Packet.unpack(self, buf)
+        if self.version != version:
+            raise PktError("Wrong version")
+
+
+_msg_classes = {
+    MsgType.refresh: Refresh,
+    MsgType.resend: Resend,
+    MsgType.delta: Delta,
+}
+
+
+def decode(buf):
+    """ Decode buf into a pkt object of the class for its msg type. """
+
+    if len(buf) < _type.size:
+        raise PktError("Short packet")
+    (ver, msgtype) = _type.unpack_from(buf)
+    cls = _msg_classes.get(msgtype)
+    if cls is None:
+        raise PktError("Unknown msg type %d" % msgtype)
+    return cls(buf)
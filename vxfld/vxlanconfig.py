@@ -0,0 +1,288 @@
+#! /usr/bin/python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 Cumulus Networks, Inc. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.
+# 51 Franklin Street, Fifth Floor
+# Boston, MA  02110-1301, USA.
+
+"""
+VXLAN config discovery
+
+The VXLAN interfaces are learned from link events rather than by
+polling ip link.  A source of link events has:
+
+    fileno()    for select, readable when there are events
+    dump()      returns all the links, as events
+    read()      returns the events waiting, or None if some were lost
+                and the caller must dump() again
+
+Each event is a tuple (ifindex, name, vxlan), where vxlan is (vni,
+local, svcnode) for a VXLAN interface and None for any other.  A
+deleted link has name None.  local and svcnode are None if not set on
+the interface.
+
+NetlinkSource gets the events from rtnetlink.  VxlanConfig turns the
+events into the VXLAN config.
+"""
+
+import errno
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 1
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+
+NLM_F_REQUEST = 0x001
+NLM_F_DUMP = 0x300
+
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_VXLAN_ID = 1
+IFLA_VXLAN_GROUP = 2
+IFLA_VXLAN_LOCAL = 4
+
+NLA_TYPE_MASK = 0x3fff
+
+_nlmsghdr = struct.Struct('=IHHII')     # len, type, flags, seq, pid
+_ifinfomsg = struct.Struct('=BxHiII')   # family, type, index, flags, change
+_rtattr = struct.Struct('=HH')          # len, type
+_u32 = struct.Struct('=I')
+
+RCVBUF = 4 * 1024 * 1024
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attrs(buf, pos, end):
+    """ Yields (type, start, end) of the data of each attr in buf. """
+
+    while pos + _rtattr.size <= end:
+        (length, atype) = _rtattr.unpack_from(buf, pos)
+        if length < _rtattr.size or pos + length > end:
+            return
+        yield (atype & NLA_TYPE_MASK, pos + _rtattr.size, pos + length)
+        pos += _align(length)
+
+
+def _messages(buf):
+    """ Yields (type, start, end) of the payload of each msg in buf. """
+
+    pos = 0
+    while pos + _nlmsghdr.size <= len(buf):
+        (length, msgtype, flags, seq, pid) = _nlmsghdr.unpack_from(buf, pos)
+        if length < _nlmsghdr.size or pos + length > len(buf):
+            return
+        yield (msgtype, pos + _nlmsghdr.size, pos + length)
+        pos += _align(length)
+
+
+def _parse_vxlan(buf, pos, end):
+    vni = local = svcnode = None
+    for (atype, start, stop) in _attrs(buf, pos, end):
+        if atype == IFLA_VXLAN_ID:
+            vni = _u32.unpack_from(buf, start)[0]
+        elif atype == IFLA_VXLAN_LOCAL:
+            local = socket.inet_ntoa(buf[start:start + 4])
+        elif atype == IFLA_VXLAN_GROUP:
+            svcnode = socket.inet_ntoa(buf[start:start + 4])
+    if vni is None:
+        return None
+    return (vni, local, svcnode)
+
+
+def _parse_link(buf, msgtype, pos, end):
+    """ The event for an RTM_NEWLINK or RTM_DELLINK msg. """
+
+    ifindex = _ifinfomsg.unpack_from(buf, pos)[2]
+    if msgtype == RTM_DELLINK:
+        return (ifindex, None, None)
+    name = None
+    vxlan = None
+    for (atype, start, stop) in _attrs(buf, pos + _ifinfomsg.size, end):
+        if atype == IFLA_IFNAME:
+            name = buf[start:stop].rstrip('\0')
+        elif atype == IFLA_LINKINFO:
+            kind = None
+            data = None
+            for (itype, istart, istop) in _attrs(buf, start, stop):
+                if itype == IFLA_INFO_KIND:
+                    kind = buf[istart:istop].rstrip('\0')
+                elif itype == IFLA_INFO_DATA:
+                    data = (istart, istop)
+            if kind == 'vxlan' and data:
+                vxlan = _parse_vxlan(buf, data[0], data[1])
+    return (ifindex, name, vxlan)
+
+
+def _parse(buf, events):
+    """ Add the events in buf to events.  Returns True at NLMSG_DONE. """
+
+    for (msgtype, start, end) in _messages(buf):
+        if msgtype == NLMSG_DONE:
+            return True
+        if msgtype == NLMSG_ERROR:
+            err = -struct.unpack_from('=i', buf, start)[0]
+            if err:
+                raise RuntimeError('Netlink error: %s' % os.strerror(err))
+        elif msgtype in (RTM_NEWLINK, RTM_DELLINK):
+            events.append(_parse_link(buf, msgtype, start, end))
+    return False
+
+
+class NetlinkSource(object):
+    """ Link events from rtnetlink. """
+
+    def __init__(self):
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                      NETLINK_ROUTE)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+            self.sock.bind((0, RTMGRP_LINK))
+        except (AttributeError, socket.error) as e:
+            raise RuntimeError('Cannot open rtnetlink socket: %s' % str(e))
+        self.sock.setblocking(0)
+        self.seq = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def dump(self):
+        # On a socket of its own so that the replies aren't mixed up
+        # with the events.  Any event that races with the dump is read
+        # after it, and is the more recent.
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+        try:
+            sock.bind((0, 0))
+            self.seq += 1
+            req = (_nlmsghdr.pack(_nlmsghdr.size + _ifinfomsg.size,
+                                  RTM_GETLINK, NLM_F_REQUEST | NLM_F_DUMP,
+                                  self.seq, 0) +
+                   _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+            sock.send(req)
+            links = []
+            while not _parse(sock.recv(65536), links):
+                pass
+        except socket.error as e:
+            raise RuntimeError('Netlink link dump failed: %s' % str(e))
+        finally:
+            sock.close()
+        return links
+
+    def read(self):
+        events = []
+        while True:
+            try:
+                buf = self.sock.recv(65536)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                if e.errno == errno.ENOBUFS:
+                    # The kernel dropped events
+                    return None
+                raise
+            _parse(buf, events)
+
+
+class VxlanConfig(object):
+    """
+    The VXLAN config, vnis[vni] = [local_ip, sn_ip], kept up to date
+    from link events.  local_addr and svcnode are used for VXLAN
+    interfaces that don't have their own.  A VNI with no usable local
+    or svcnode address is left out of vnis and put in incomplete, with
+    the name of what is missing.
+    """
+
+    def __init__(self, local_addr, svcnode):
+        self.local_addr = local_addr
+        self.svcnode = svcnode
+        self.links = {}     # ifindex -> (name, vxlan)
+        self.vni_links = {}     # vni -> set(ifindex) of its links
+        self.vnis = {}
+        self.names = {}     # vni -> name of its interface
+        self.incomplete = {}
+
+    def reset(self, links):
+        """
+        Replace everything with links, as from a dump().  Returns the
+        VNIs that changed, as for update().
+        """
+
+        present = set(link[0] for link in links)
+        gone = [(ifindex, None, None) for ifindex in self.links
+                if ifindex not in present]
+        return self.update(gone + links)
+
+    def update(self, events):
+        """
+        Apply the events.  Returns the VNIs that changed, as a dict of
+        their old config, changed[vni] = [local_ip, sn_ip] or None if
+        the VNI was not in vnis before.
+        """
+
+        touched = set()
+        for (ifindex, name, vxlan) in events:
+            old = self.links.pop(ifindex, (None, None))[1]
+            if old:
+                touched.add(old[0])
+                ifindexes = self.vni_links[old[0]]
+                ifindexes.discard(ifindex)
+                if not ifindexes:
+                    del self.vni_links[old[0]]
+            if name is not None:
+                self.links[ifindex] = (name, vxlan)
+                if vxlan:
+                    touched.add(vxlan[0])
+                    self.vni_links.setdefault(vxlan[0], set()).add(ifindex)
+
+        changed = {}
+        for vni in touched:
+            old = (self.vnis.get(vni), self.names.get(vni))
+            self._rebuild(vni)
+            if (self.vnis.get(vni), self.names.get(vni)) != old:
+                changed[vni] = old[0]
+        return changed
+
+    def _rebuild(self, vni):
+        # Work out the config of one VNI from its links
+        self.vnis.pop(vni, None)
+        self.names.pop(vni, None)
+        self.incomplete.pop(vni, None)
+        for ifindex in sorted(self.vni_links.get(vni, ())):
+            (name, vxlan) = self.links[ifindex]
+            local = vxlan[1] or self.local_addr
+            svcnode = vxlan[2] or self.svcnode
+            if not local or local == '0.0.0.0':
+                self.incomplete[vni] = 'local addr'
+            elif not svcnode or svcnode == '0.0.0.0':
+                self.incomplete[vni] = 'svcnode'
+            else:
+                self.vnis[vni] = [local, svcnode]
+                self.names[vni] = name
+                self.incomplete.pop(vni, None)
+                return